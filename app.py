@@ -1,74 +1,205 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
+import numpy as np
+from numba import njit, prange
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="Stock Data Screener", layout="wide")
 
+# How long fetched data stays fresh in the cache
+CACHE_TTL_SECONDS = 300
+
 # --- DATA FETCHING FUNCTION ---
-def fetch_stock_data(tickers):
-    data = []
+def _fetch_shares(symbol):
+    # Share count isn't part of yf.download, so it's still one call per symbol. Market
+    # cap is derived from it and the batched close; fast_info['market_cap'] would
+    # also fetch its own 1y history per symbol just to get the last price.
+    # Runs on a worker thread; a failure here only costs us the Market Cap.
+    try:
+        return yf.Ticker(symbol).fast_info['shares']
+    except Exception:
+        return None
+
+# yf.download keeps each call's results in module-global state that the next call
+# resets, so concurrent downloads (e.g. two sessions refreshing) must not overlap
+@st.cache_resource
+def _download_lock():
+    return threading.Lock()
+
+# Resolved here on the script thread; _download_history runs on a worker thread
+DOWNLOAD_LOCK = _download_lock()
+
+def _download_history(symbols):
+    with DOWNLOAD_LOCK:
+        return yf.download(
+            " ".join(symbols), period="1y", group_by='ticker',
+            threads=True, progress=False, auto_adjust=True
+        )
+
+def _symbol_history(panel, symbol):
+    # group_by='ticker' gives (symbol, field) columns; a lone symbol may come back flat
+    if isinstance(panel.columns, pd.MultiIndex):
+        if symbol not in panel.columns.get_level_values(0):
+            return pd.DataFrame()
+        hist = panel[symbol]
+    elif 'Close' in panel.columns:
+        hist = panel
+    else:
+        # Nothing came back at all (e.g. every symbol failed)
+        return pd.DataFrame()
+    # Symbols with a shorter history are NaN-padded to the panel's date index
+    return hist.dropna(subset=['Close'])
+
+def _stack_field(hists, field):
+    """Stack one OHLC field into an (n_symbols, n_days) array.
+
+    Histories are right-aligned so column -1 is each symbol's latest session;
+    shorter histories are NaN-padded at the front. Kept as float64: float32
+    spacing exceeds $0.01 above ~$131k, too coarse for cent-exact prices.
+    """
+    n_days = max(len(hist) for hist in hists)
+    out = np.full((len(hists), n_days), np.nan)
+    for i, hist in enumerate(hists):
+        values = hist[field].to_numpy(dtype=float)
+        out[i, n_days - len(values):] = values
+    return out
+
+@njit(parallel=True, cache=True, error_model='numpy')
+def _metrics_kernel(closes, highs, lows, lengths, out):
+    """Fill out[i] with the eight numeric screener columns for symbol i.
+
+    Columns: Current, %Chg, 52L, 52H, %52L, %52H, %BBL, %BBH. Only the last
+    lengths[i] sessions of each row are real data; the rest is padding.
+    error_model='numpy' keeps a zero price (bad tick) yielding inf/NaN like
+    pandas did, rather than raising ZeroDivisionError.
+    """
+    n_symbols, n_days = closes.shape
+    for i in prange(n_symbols):
+        start = n_days - lengths[i]
+        
+        # Current & Previous Price (for Daily % Change)
+        current_price = closes[i, n_days - 1]
+        prev_price = closes[i, n_days - 2]
+        
+        # 52-Week Metrics
+        low_52w = np.inf
+        high_52w = -np.inf
+        for k in range(start, n_days):
+            if lows[i, k] < low_52w:
+                low_52w = lows[i, k]
+            if highs[i, k] > high_52w:
+                high_52w = highs[i, k]
+        
+        # Bollinger Bands (20-day) - Welford's update gives mean and std in one pass
+        if lengths[i] >= 20:
+            sma_20 = 0.0
+            sq_dev = 0.0
+            for k in range(20):
+                x = closes[i, n_days - 20 + k]
+                delta = x - sma_20
+                sma_20 += delta / (k + 1)
+                sq_dev += delta * (x - sma_20)
+            std_20 = np.sqrt(sq_dev / 19)
+        else:
+            sma_20 = np.nan
+            std_20 = np.nan
+        
+        bb_low = sma_20 - (2 * std_20)
+        bb_high = sma_20 + (2 * std_20)
+        
+        out[i, 0] = current_price
+        out[i, 1] = ((current_price - prev_price) / prev_price) * 100
+        out[i, 2] = low_52w
+        out[i, 3] = high_52w
+        out[i, 4] = ((current_price - low_52w) / low_52w) * 100
+        out[i, 5] = ((current_price - high_52w) / high_52w) * 100
+        out[i, 6] = ((current_price - bb_low) / bb_low) * 100
+        out[i, 7] = ((current_price - bb_high) / bb_high) * 100
+
+def _compute_metrics(symbols, hists, shares):
+    """Compute the screener table for all symbols in one fused kernel pass."""
+    closes = _stack_field(hists, 'Close')
+    highs = _stack_field(hists, 'High')
+    lows = _stack_field(hists, 'Low')
+    lengths = np.array([len(hist) for hist in hists], dtype=np.int64)
     
-    for symbol in tickers:
-        symbol = symbol.strip().upper()
-        if not symbol:
+    out = np.empty((len(symbols), 8))
+    _metrics_kernel(closes, highs, lows, lengths, out)
+    
+    return pd.DataFrame({
+        "Symbol": symbols,
+        "Current": out[:, 0],
+        "%Chg": out[:, 1],
+        # Market Cap (ETFs have no share count, so keep the 'N/A' placeholder)
+        "MCap": ['N/A' if n is None else n * price for n, price in zip(shares, out[:, 0])],
+        "52L": out[:, 2],
+        "52H": out[:, 3],
+        "%52L": out[:, 4],
+        "%52H": out[:, 5],
+        "%BBL": out[:, 6],
+        "%BBH": out[:, 7]
+    })
+
+# Cached per ticker tuple, so reruns and refreshes within the TTL skip the network.
+# Returns (df, fetched_at) so the timestamp reflects when the data was actually pulled;
+# failures raise instead of returning empty so they aren't cached for the whole TTL.
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_stock_data(symbols):
+    if not symbols:
+        return pd.DataFrame(), None
+    
+    # One batched request for 1 year of history across all symbols, with the
+    # per-symbol share count lookups running alongside it
+    with ThreadPoolExecutor(max_workers=min(32, len(symbols) + 1)) as executor:
+        panel_future = executor.submit(_download_history, symbols)
+        shares = list(executor.map(_fetch_shares, symbols))
+        panel = panel_future.result()
+    
+    valid_symbols, hists, valid_shares = [], [], []
+    for symbol, share_count in zip(symbols, shares):
+        hist = _symbol_history(panel, symbol)
+        # Check if data is empty or too short (invalid symbol or brand new IPO)
+        if len(hist) < 2:
+            st.error(f"⚠️ Not enough data found for symbol: '{symbol}'")
             continue
-            
-        try:
-            ticker = yf.Ticker(symbol)
-            # Fetch 1 year of history
-            hist = ticker.history(period="1y")
-            info = ticker.info
-            
-            # Check if data is empty or too short (invalid symbol or brand new IPO)
-            if hist.empty or len(hist) < 2:
-                st.error(f"⚠️ Not enough data found for symbol: '{symbol}'")
-                continue
-                
-            # Current & Previous Price (for Daily % Change)
-            current_price = hist['Close'].iloc[-1]
-            prev_price = hist['Close'].iloc[-2]
-            daily_pct_change = ((current_price - prev_price) / prev_price) * 100
-            
-            # Market Cap (Handle missing keys safely)
-            market_cap = info.get('marketCap', 'N/A')
-            
-            # 52-Week Metrics
-            low_52w = hist['Low'].min()
-            high_52w = hist['High'].max()
-            
-            pct_from_52w_low = ((current_price - low_52w) / low_52w) * 100
-            pct_from_52w_high = ((current_price - high_52w) / high_52w) * 100
-            
-            # Bollinger Bands (20-day)
-            sma_20 = hist['Close'].rolling(window=20).mean().iloc[-1]
-            std_20 = hist['Close'].rolling(window=20).std().iloc[-1]
-            
-            bb_low = sma_20 - (2 * std_20)
-            bb_high = sma_20 + (2 * std_20)
-            
-            pct_from_bb_low = ((current_price - bb_low) / bb_low) * 100
-            pct_from_bb_high = ((current_price - bb_high) / bb_high) * 100
-            
-            # Append to list with the new %Chg column
-            data.append({
-                "Symbol": symbol,
-                "Current": current_price,
-                "%Chg": daily_pct_change,
-                "MCap": market_cap,
-                "52L": low_52w,
-                "52H": high_52w,
-                "%52L": pct_from_52w_low,
-                "%52H": pct_from_52w_high,
-                "%BBL": pct_from_bb_low,
-                "%BBH": pct_from_bb_high
-            })
-            
-        except Exception as e:
-            st.error(f"❌ Error fetching '{symbol}': {e}")
-            
-    return pd.DataFrame(data)
+        valid_symbols.append(symbol)
+        hists.append(hist)
+        valid_shares.append(share_count)
+    
+    if not valid_symbols:
+        raise ValueError("no usable price history for any symbol")
+    
+    fetched_at = datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")
+    return _compute_metrics(valid_symbols, hists, valid_shares), fetched_at
+
+# --- TABLE FORMATTING ---
+# The table schema is fixed by _compute_metrics; its column groups, order and config
+# are defined in one place here and reused by render_table
+PCT_COLS = ("%Chg", "%52L", "%52H", "%BBL", "%BBH")
+PRICE_COLS = ("Current", "52L", "52H")
+
+TABLE_COLUMN_ORDER = ("Symbol", "Buy", "Current", "%Chg", "MCap", "52L", "52H", "%52L", "%52H", "%BBL", "%BBH")
+TABLE_COLUMN_CONFIG = {
+    "Buy": st.column_config.CheckboxColumn("Buy", help="Within 2.5% of the lower Bollinger Band"),
+    **{c: st.column_config.NumberColumn(format="%.2f%%") for c in PCT_COLS},
+    **{c: st.column_config.NumberColumn(format="%.2f") for c in PRICE_COLS},
+}
+
+# Format Market Cap nicely (Trillions/Billions/Millions)
+def format_market_cap(col):
+    # Pick each value's scale & suffix in one vectorized pass; non-numeric
+    # entries (e.g. 'N/A') and values under a million pass through unchanged
+    mc = pd.to_numeric(col, errors='coerce').to_numpy(dtype=float)
+    scale = np.select([mc >= 1e12, mc >= 1e9, mc >= 1e6], [1e12, 1e9, 1e6], np.nan)
+    suffix = np.select([mc >= 1e12, mc >= 1e9, mc >= 1e6], ['T', 'B', 'M'], '')
+    return [
+        f"${v/s:.2f}{sx}" if sx else orig
+        for v, s, sx, orig in zip(mc, scale, suffix, col)
+    ]
 
 # --- SESSION STATE SETUP ---
 if "df" not in st.session_state:
@@ -83,10 +214,19 @@ st.title("📈 Stock Data Screener")
 default_symbols = "AVGO,GOOG,TSM,MRVL,CRDO,SOXL,TQQQ,TSLA,MU"
 ticker_input = st.text_input("Enter Stock Symbols (comma-separated):", default_symbols)
 
+# Parse once per distinct input string. Normalizing to a sorted, deduplicated
+# tuple also lets the same set of symbols share a fetch_stock_data cache entry.
+@st.cache_data(show_spinner=False)
+def parse_tickers(raw):
+    return tuple(sorted({s.strip().upper() for s in raw.split(",") if s.strip()}))
+
 # Wrapper function to update state
 def update_data():
-    ticker_list = ticker_input.split(",")
-    new_df = fetch_stock_data(ticker_list)
+    try:
+        new_df, fetched_at = fetch_stock_data(parse_tickers(ticker_input))
+    except Exception as e:
+        st.error(f"❌ Error fetching price history: {e}")
+        return
     
     # Only update state if we got data back
     if not new_df.empty:
@@ -95,83 +235,51 @@ def update_data():
             new_df = new_df.sort_values(by='%BBL', ascending=True).reset_index(drop=True)
             
         st.session_state.df = new_df
-        st.session_state.last_updated = datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")
+        st.session_state.last_updated = fetched_at
 
 # --- AUTO-UPDATE LOGIC ---
 if st.session_state.df.empty:
     with st.spinner("Fetching morning data..."):
         update_data()
 
-# --- CONTROL BAR (Timestamp & Refresh) ---
-col1, col2 = st.columns([3, 1])
+# --- DISPLAY LOGIC ---
+# Number formatting happens client-side in st.dataframe, so no Styler/CSS is built in Python
+def render_table(df):
+    df_display = df.assign(**{
+        # Format Market Cap nicely (Trillions/Billions/Millions)
+        "MCap": format_market_cap(df['MCap']),
+        # Flag symbols in the Buy Zone (< 2.5% from BBL)
+        "Buy": df['%BBL'] < 2.5
+    })
 
-with col1:
-    st.info(f"🕒 **Last Updated:** {st.session_state.last_updated}")
+    st.dataframe(
+        df_display,
+        use_container_width=True,
+        hide_index=True,
+        column_order=TABLE_COLUMN_ORDER,
+        column_config=TABLE_COLUMN_CONFIG
+    )
 
-with col2:
-    if st.button("🔄 Refresh Now", use_container_width=True):
-        with st.spinner("Pulling latest data..."):
-            update_data()
-            st.rerun() 
+# --- CONTROL BAR (Timestamp & Refresh) & TABLE ---
+# A fragment, so clicking its buttons reruns only this region instead of the whole script
+@st.fragment
+def control_and_table():
+    col1, col2, col3 = st.columns([3, 1, 1])
 
-# --- DISPLAY LOGIC ---
-if not st.session_state.df.empty:
-    df_display = st.session_state.df.copy()
-    
-    # 1. Format Market Cap nicely (Trillions/Billions/Millions)
-    def format_market_cap(x):
-        if isinstance(x, (int, float)):
-            if x >= 1e12: return f"${x/1e12:.2f}T"
-            elif x >= 1e9: return f"${x/1e9:.2f}B"
-            elif x >= 1e6: return f"${x/1e6:.2f}M"
-        return x
-    
-    if 'MCap' in df_display.columns:
-        df_display['MCap'] = df_display['MCap'].apply(format_market_cap)
-
-    # 2. Define Styling Logic
-    def color_percentages(val):
-        if isinstance(val, (int, float)):
-            if val > 0:
-                return 'color: #2e8b57; font-weight: bold;' # Green
-            elif val < 0:
-                return 'color: #ff4b4b; font-weight: bold;' # Red
-        return ''
-
-    # NEW: Row-wise styling to highlight the Symbol if it's in the Buy Zone (< 2% from BBL)
-    def highlight_buy_zone(row):
-        # We check if the BBL% is less than 2.0. If so, apply red color to the 'Symbol' column.
-        return [
-            'color: #ff4b4b; font-weight: bold; text-decoration: underline;' 
-            if col == 'Symbol' and row.get('%BBL', 100) < 2.5 
-            else '' 
-            for col in row.index
-        ]
-
-    # Identify columns for specific formatting
-    pct_cols = [c for c in ["%Chg", "%52L", "%52H", "%BBL", "%BBH"] if c in df_display.columns]
-    price_cols = [c for c in ["Current", "52L", "52H"] if c in df_display.columns]
-
-    # 3. Apply Pandas Styler
-    styled_df = df_display.style
-    
-    # Center all text in cells
-    styled_df = styled_df.set_properties(**{'text-align': 'center'})
-    
-    # Center all headers
-    styled_df = styled_df.set_table_styles([dict(selector='th', props=[('text-align', 'center')])])
+    with col1:
+        st.info(f"🕒 **Last Updated:** {st.session_state.last_updated}")
 
-    # Apply Green/Red colors to percentage columns and add '%' sign
-    if pct_cols:
-        styled_df = styled_df.map(color_percentages, subset=pct_cols)
-        styled_df = styled_df.format("{:.2f}%", subset=pct_cols)
+    with col2:
+        if st.button("🔄 Refresh Now", use_container_width=True):
+            with st.spinner("Pulling latest data..."):
+                update_data()
+                st.rerun(scope="fragment")
 
-    # Force 2 decimal places for price columns
-    if price_cols:
-        styled_df = styled_df.format("{:.2f}", subset=price_cols)
+    with col3:
+        if st.button("🧹 Clear Cache", use_container_width=True):
+            fetch_stock_data.clear()
 
-    # Apply the Buy Zone highlight to the Symbol column
-    styled_df = styled_df.apply(highlight_buy_zone, axis=1)
+    if not st.session_state.df.empty:
+        render_table(st.session_state.df)
 
-    # 4. Render the table
-    st.dataframe(styled_df, use_container_width=True, hide_index=True)
\ No newline at end of file
+control_and_table()